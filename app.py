@@ -5,22 +5,48 @@
 
 import os
 import json
+import atexit
+import contextlib
+import functools
 import hashlib
+import hmac
+import io
+import logging
+import math
+import pickle
+import queue
 import re
+import sqlite3
+import threading
 import unicodedata
+from decimal import Decimal, ROUND_HALF_EVEN
 from pathlib import Path
 
 import streamlit as st
-from math import ceil, floor
-import matplotlib.pyplot as plt  # per il grafico a torta
+
+try:
+    import orjson
+except Exception:  # pragma: no cover - optional faster JSON encoder/parser
+    orjson = None
+
+try:
+    import xxhash
+
+    def _digest64(data: bytes) -> int:
+        return xxhash.xxh3_64(data).intdigest()
+except Exception:  # pragma: no cover - fallback if xxhash missing
+    def _digest64(data: bytes) -> int:
+        return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
 try:
-    from babel.numbers import format_currency
-except Exception:  # pragma: no cover - fallback if Babel missing
-    def format_currency(amount, currency, locale="en_US"):
-        symbol = "€" if currency == "EUR" else "$"
-        return f"{symbol}{amount:,.2f}"
+    from blake3 import blake3 as _blake3
+except Exception:  # pragma: no cover - optional faster hash for license keys
+    _blake3 = None
 
-from calc import unit_cost, batch_total_cost, batch_total_weight_kg, to_base
+from calc import (
+    UNIT_FACTOR, Item, as_item, batch_summary, unit_cost, unit_costs,
+    ingredient_soa, update_ingredient_soa, density_soa, items_cost,
+)
 
 # -----------------------------------------------------------------------------
 # CONFIG
@@ -29,173 +55,586 @@ st.set_page_config(page_title="Food Cost Calculator", layout="wide")
 
 # Data persistence utilities ---------------------------------------------------
 DATA_DIR = Path(__file__).parent / "data"
+_log = logging.getLogger(__name__)
 
 
-def load_state(name: str, default):
-    path = DATA_DIR / f"{name}.json"
-    if path.exists():
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        if isinstance(data, dict) and isinstance(default, dict):
-            merged = default.copy()
-            merged.update(data)
-            return merged
-        return data
-    DATA_DIR.mkdir(exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(default, f, ensure_ascii=False, indent=2)
-    return default
+def _dumps(data) -> bytes:
+    """Compact UTF-8 JSON; orjson when installed (``Item`` rows are written as lists)."""
+    if orjson is not None:
+        return orjson.dumps(data, default=list, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _loads(raw: bytes):
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
 
 
-def save_state(name: str, data):
+# Stato in SQLite (WAL): una riga kv per (namespace, chiave) ---------------------
+# Rows keep their rowid on update (UPSERT, not INSERT OR REPLACE), so reading
+# back ``ORDER BY rowid`` preserves the dicts' insertion order.
+_UPSERT = "INSERT INTO kv (ns, k, v) VALUES (?, ?, ?) ON CONFLICT (ns, k) DO UPDATE SET v = excluded.v"
+
+
+@st.cache_resource(show_spinner=False)
+def _db() -> tuple[sqlite3.Connection, threading.Lock]:
+    """Process-wide connection to ``data/state.sqlite`` and the lock serialising its use."""
     DATA_DIR.mkdir(exist_ok=True)
-    path = DATA_DIR / f"{name}.json"
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    conn = sqlite3.connect(DATA_DIR / "state.sqlite", isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS kv (ns TEXT, k TEXT, v BLOB, PRIMARY KEY (ns, k))")
+    conn.execute("CREATE TABLE IF NOT EXISTS migrated (ns TEXT PRIMARY KEY)")
+    return conn, threading.Lock()
+
+
+@contextlib.contextmanager
+def _transaction():
+    """Hold the connection lock for one transaction; roll back if anything fails,
+    so the shared connection is never left inside an open transaction."""
+    conn, lock = _db()
+    with lock:
+        conn.execute("BEGIN")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+
+def _apply_rows(conn: sqlite3.Connection, changes: dict[str, tuple[dict[str, bytes], set]]) -> None:
+    for ns, (upserts, deletes) in changes.items():
+        conn.executemany("DELETE FROM kv WHERE ns = ? AND k = ?", [(ns, k) for k in deletes])
+        conn.executemany(_UPSERT, [(ns, k, v) for k, v in upserts.items()])
+
+
+def _write_rows(changes: dict[str, tuple[dict[str, bytes], set]]) -> None:
+    """Apply ``{ns: (upserts, deletes)}`` in a single transaction, deletes first.
+
+    Revs are bumped only after COMMIT, so a reader never caches a pre-write
+    snapshot under the new rev, and a failed write invalidates nothing.
+    """
+    with _transaction() as conn:
+        _apply_rows(conn, changes)
+    for ns in changes:
+        _bump_rev(ns)
+
+
+def _coalesce(saves: list) -> dict[str, tuple[dict[str, bytes], set]]:
+    """Merge queued ``(ns, upserts, deletes)`` saves in order: the last write to a key wins.
+
+    A key deleted and then re-added keeps its delete, so (deletes running
+    first) it is re-inserted at the end exactly as the session dict has it.
+    """
+    merged: dict[str, tuple[dict[str, bytes], set]] = {}
+    for ns, upserts, deletes in saves:
+        up, dl = merged.setdefault(ns, ({}, set()))
+        for k in deletes:
+            up.pop(k, None)
+            dl.add(k)
+        up.update(upserts)
+    return merged
+
+
+@st.cache_resource(show_spinner=False)
+def _ns_revs() -> tuple[dict[str, int], threading.Lock]:
+    """Process-wide write counter per namespace (part of the ``_read_ns`` cache key) and its lock."""
+    return {}, threading.Lock()
+
+
+def _bump_rev(name: str) -> None:
+    revs, lock = _ns_revs()
+    with lock:  # concurrent sessions must not lose an increment
+        revs[name] = revs.get(name, 0) + 1
+
+
+@st.cache_resource(show_spinner=False)
+def _writer_status() -> dict:
+    """Last write error of the state writer and the coalesced changes kept for retry."""
+    return {"error": None, "pending": {}}
+
+
+@st.cache_resource(show_spinner=False)
+def _state_writer() -> queue.Queue:
+    """Process-wide queue of ``(ns, upserts, deletes)`` drained by one daemon writer thread.
+
+    Saves return as soon as the changed rows are queued. The writer takes
+    everything queued so far, so a burst of edits is debounced into one
+    transaction of net changes. A failed write is logged and its net changes
+    are kept, to be written again ahead of the next batch; the thread stays alive.
+    """
+    q: queue.Queue = queue.Queue()
+    status = _writer_status()
+
+    def flush(saves: list) -> None:
+        # pending retries go first; keeping them coalesced bounds them by the distinct keys
+        changes = _coalesce([(ns, up, dl) for ns, (up, dl) in status["pending"].items()] + saves)
+        try:
+            _write_rows(changes)
+        except Exception as exc:
+            _log.exception("Saving state failed; keeping the changes for retry")
+            status["error"], status["pending"] = exc, changes
+        else:
+            status["error"], status["pending"] = None, {}
+
+    def run():
+        while True:
+            batch = [q.get()]
+            while True:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                flush(batch)
+            finally:
+                for _ in batch:
+                    q.task_done()
+
+    def shutdown():
+        q.join()  # don't drop queued saves on shutdown
+        if status["pending"]:
+            flush([])
+
+    threading.Thread(target=run, name="state-writer", daemon=True).start()
+    atexit.register(shutdown)
+    return q
+
+
+@st.cache_data(show_spinner=False)
+def _read_ns(ns: str, rev: int) -> tuple[dict, dict]:
+    """Return ``(raw_rows, parsed)`` for a namespace; ``rev`` keys the cache so saves invalidate it."""
+    conn, lock = _db()
+    with lock:
+        rows = conn.execute("SELECT k, v FROM kv WHERE ns = ? ORDER BY rowid", (ns,)).fetchall()
+    raw = dict(rows)
+    return raw, {k: _loads(v) for k, v in raw.items()}
+
+
+def _migrate(name: str, default: dict) -> None:
+    """First run of a namespace: import the legacy ``data/<name>.json`` (or the defaults).
+
+    The rows and the ``migrated`` marker are written in one transaction.
+    """
+    with _transaction() as conn:
+        if conn.execute("SELECT 1 FROM migrated WHERE ns = ?", (name,)).fetchone():
+            return
+        path = DATA_DIR / f"{name}.json"
+        data = _loads(path.read_bytes()) if path.exists() else default
+        _apply_rows(conn, {name: ({k: _dumps(v) for k, v in data.items()}, set())})
+        conn.execute("INSERT INTO migrated (ns) VALUES (?)", (name,))
+    _bump_rev(name)
+
+
+def load_state(name: str, default: dict) -> dict:
+    _state_writer().join()  # read our own pending saves
+    _migrate(name, default)
+    raw, data = _read_ns(name, _ns_revs()[0].get(name, 0))
+    st.session_state[f"_saved_{name}_rows"] = raw
+    merged = default.copy()
+    merged.update(data)
+    return merged
+
+
+def save_state(name: str, data: dict):
+    """Persist the entries of ``data`` that changed since the last save or load.
+
+    Only changed keys are upserted and removed keys deleted, in one
+    transaction on the background writer; nothing is queued if nothing changed.
+    """
+    rows = {k: _dumps(v) for k, v in data.items()}
+    snap_key = f"_saved_{name}_rows"
+    saved = st.session_state.get(snap_key, {})
+    upserts = {k: v for k, v in rows.items() if saved.get(k) != v}
+    deletes = saved.keys() - rows.keys()
+    if not upserts and not deletes:
+        return
+    _state_writer().put((name, upserts, deletes))
+    st.session_state[snap_key] = rows
+    err = _writer_status()["error"]
+    if err is not None:
+        st.warning(f"Saving failed ({err}); your changes are kept and retried on the next save.")
+    if name == "ingredients":
+        soa = st.session_state.get("_ing_soa")
+        if soa is None or deletes or not upserts.keys() <= soa.index.keys():
+            st.session_state["_ing_soa"] = ingredient_soa(data)
+        else:  # price/size edits of existing ingredients: patch just those rows
+            for k in upserts:
+                update_ingredient_soa(soa, k, data[k])
+    elif name == "densities":
+        st.session_state["_dens_soa"] = density_soa(data)
+    st.session_state["data_rev"] = st.session_state.get("data_rev", 0) + 1
 
 # -----------------------------------------------------------------------------
 # LICENSE (demo)
 # -----------------------------------------------------------------------------
-def _hash_key(key: str) -> str:
-    """Return SHA-256 hex digest of the given key."""
-    return hashlib.sha256(key.encode("utf-8")).hexdigest()
-
 # Environment variable can contain multiple keys separated by commas or spaces
-VALID_KEYS = {
-    _hash_key(k.strip().upper())
-    for k in re.split(r"[\s,]+", os.environ.get("APP_PASS", ""))
-    if k.strip()
-}
+_PASS_SPLIT = re.compile(r"[\s,]+")
 
-if "unlocked" not in st.session_state:
-    st.session_state.unlocked = False
+def _hash_key(key: str) -> str:
+    """Return a 128-bit hex digest of the given key (BLAKE3 if installed, else BLAKE2b).
+
+    Digests are only compared within one process, so the choice of hash never
+    has to match anything persisted. Not memoized: a cache would keep every
+    attempted key in memory, and the configured ones are cached as digests.
+    """
+    data = key.encode("utf-8")
+    if _blake3 is not None:
+        return _blake3(data).hexdigest(length=16)
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+@st.cache_resource(show_spinner=False)
+def _load_valid_keys(raw: str) -> frozenset:
+    """Parse and hash the configured keys once per process (keyed on the raw env value)."""
+    return frozenset(
+        _hash_key(k.strip().upper())
+        for k in _PASS_SPLIT.split(raw)
+        if k.strip()
+    )
+
+def _valid_keys() -> frozenset:
+    """Digests of the keys in ``APP_PASS``, read at call time (parsed once per value)."""
+    return _load_valid_keys(os.environ.get("APP_PASS", ""))
 
 def check_key(k: str) -> bool:
     k = (k or "").strip()
     if not k:
         return False
-    return _hash_key(k.upper()) in VALID_KEYS
-
-if not VALID_KEYS:
-    st.info("Running in demo mode — no license required.")
-    st.session_state.unlocked = True
-elif not st.session_state.unlocked:
-    st.title("Enter License Key")
-    key = st.text_input("License key", type="password", key="license_input")
-    if st.button("Unlock", key="license_btn"):
-        if check_key(key):
-            st.session_state.unlocked = True
-            st.success("Unlocked")
-            st.rerun()
-        else:
-            st.error("Invalid key")
-    st.stop()
+    digest = _hash_key(k.upper())
+    return any(hmac.compare_digest(digest, v) for v in _valid_keys())
+
+def _license_gate() -> None:
+    """Unlock in demo mode (no keys); otherwise ask for a key and stop until it matches."""
+    if "unlocked" not in st.session_state:
+        st.session_state.unlocked = False
+    if not _valid_keys():
+        st.info("Running in demo mode — no license required.")
+        st.session_state.unlocked = True
+    elif not st.session_state.unlocked:
+        st.title("Enter License Key")
+        key = st.text_input("License key", type="password", key="license_input")
+        if st.button("Unlock", key="license_btn"):
+            if check_key(key):
+                st.session_state.unlocked = True
+                st.success("Unlocked")
+                st.rerun()
+            else:
+                st.error("Invalid key")
+        st.stop()
 
 # -----------------------------------------------------------------------------
 # DATI DI BASE
 # -----------------------------------------------------------------------------
-if "ingredients" not in st.session_state:
-    default_ing = {
-        "Flour 00":   {"unit": "kg", "package_qty": 25.0, "package_price": 29.90},
-        "Water":      {"unit": "L",  "package_qty": 10.0, "package_price": 1.50},
-        "Salt":       {"unit": "kg", "package_qty": 1.0,  "package_price": 0.50},
-        "Yeast":      {"unit": "kg", "package_qty": 1.0,  "package_price": 8.00},
-        "Mozzarella": {"unit": "kg", "package_qty": 1.0,  "package_price": 6.50},
-        "Tomato":     {"unit": "kg", "package_qty": 1.0,  "package_price": 1.40},
-        "Oil EVO":    {"unit": "L",  "package_qty": 1.0,  "package_price": 7.00},
-    }
-    st.session_state.ingredients = load_state("ingredients", default_ing)
-
-# densità (kg/L) per convertire volumi in peso batch
-if "densities" not in st.session_state:
-    default_dens = {"Water": 1.0, "Oil EVO": 0.91, "Milk": 1.03, "Cream": 0.99}
-    st.session_state.densities = load_state("densities", default_dens)
-
-if "batches" not in st.session_state:
-    st.session_state.batches = load_state("batches", {})
-if "recipes" not in st.session_state:
-    st.session_state.recipes = load_state("recipes", {})
-if "batch_id_counter" not in st.session_state:
-    st.session_state.batch_id_counter = 1
-if "new_batch_buffer" not in st.session_state:
-    st.session_state.new_batch_buffer = {"name": "", "category": "", "portion_weight_g": 280.0, "items": []}
-if "locale" not in st.session_state:
-    st.session_state["locale"] = "en_US"
+def _load_items(data: dict) -> dict:
+    """Turn persisted ``[name, qty, unit]`` rows (or legacy dicts) back into ``Item``s."""
+    for entry in data.values():
+        entry["items"] = [as_item(it) for it in entry.get("items", [])]
+    return data
+
+def init_session_state() -> None:
+    """Load catalog, densities, batches and recipes into the session on first run."""
+    if "ingredients" not in st.session_state:
+        default_ing = {
+            "Flour 00":   {"unit": "kg", "package_qty": 25.0, "package_price": 29.90},
+            "Water":      {"unit": "L",  "package_qty": 10.0, "package_price": 1.50},
+            "Salt":       {"unit": "kg", "package_qty": 1.0,  "package_price": 0.50},
+            "Yeast":      {"unit": "kg", "package_qty": 1.0,  "package_price": 8.00},
+            "Mozzarella": {"unit": "kg", "package_qty": 1.0,  "package_price": 6.50},
+            "Tomato":     {"unit": "kg", "package_qty": 1.0,  "package_price": 1.40},
+            "Oil EVO":    {"unit": "L",  "package_qty": 1.0,  "package_price": 7.00},
+        }
+        st.session_state.ingredients = load_state("ingredients", default_ing)
+
+    # densità (kg/L) per convertire volumi in peso batch
+    if "densities" not in st.session_state:
+        default_dens = {"Water": 1.0, "Oil EVO": 0.91, "Milk": 1.03, "Cream": 0.99}
+        st.session_state.densities = load_state("densities", default_dens)
+
+    if "batches" not in st.session_state:
+        st.session_state.batches = _load_items(load_state("batches", {}))
+    if "recipes" not in st.session_state:
+        st.session_state.recipes = _load_items(load_state("recipes", {}))
+    if "batch_id_counter" not in st.session_state:
+        st.session_state.batch_id_counter = 1
+    if "new_batch_buffer" not in st.session_state:
+        st.session_state.new_batch_buffer = {"name": "", "category": "", "portion_weight_g": 280.0, "items": []}
+    if "locale" not in st.session_state:
+        st.session_state["locale"] = "en_US"
+    # indice inverso batch_id -> ricette che lo usano (evita la scansione alla cancellazione)
+    if "batch_refs" not in st.session_state:
+        refs: dict[str, set[str]] = {}
+        for rn, rdict in st.session_state.recipes.items():
+            for bu in rdict.get("batch_uses", []):
+                refs.setdefault(bu["batch_id"], set()).add(rn)
+        st.session_state.batch_refs = refs
+    # ordine chiavi per le selectbox, aggiornato solo quando i dict cambiano
+    for _name in ("ingredients", "batches", "recipes"):
+        if f"{_name}_order" not in st.session_state:
+            st.session_state[f"{_name}_order"] = list(st.session_state[_name])
 
 # -----------------------------------------------------------------------------
 # FUNZIONI DI SUPPORTO
 # -----------------------------------------------------------------------------
+_SLUG_STRIP = re.compile(r"[^\w\s-]")
+_SLUG_SEP = re.compile(r"[\s-]+")
+
+def _ascii_fold(text: str) -> str:
+    return unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+
+# Latin-1 + Latin Extended-A (U+00C0–U+017F) piegati una volta sola: NFKD solo per il resto
+_FOLD = str.maketrans({chr(cp): _ascii_fold(chr(cp)) for cp in range(0xC0, 0x180)})
+
 def slugify(text: str) -> str:
     """Return a safe slug usable in widget keys."""
-    txt = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
-    txt = re.sub(r"[^\w\s-]", "", txt).strip().lower()
-    return re.sub(r"[\s-]+", "_", txt)
-
-def unique_slug(text: str) -> str:
-    """Return slugified text, adding a numeric suffix if already used."""
-    counts = st.session_state.setdefault("slug_counts", {})
+    txt = text.translate(_FOLD)
+    if not txt.isascii():
+        txt = _ascii_fold(txt)
+    txt = _SLUG_STRIP.sub("", txt).strip().lower()
+    return _SLUG_SEP.sub("_", txt)
+
+def unique_slug(text: str, taken=()) -> str:
+    """Return slugified text, adding a numeric suffix if it is already in ``taken``.
+
+    Nothing is reserved: callers pass the slugs currently in use, so the
+    same text gets the same slug on every rerun.
+    """
     base = slugify(text)
-    count = counts.get(base, 0)
-    counts[base] = count + 1
-    return base if count == 0 else f"{base}_{count}"
+    slug, count = base, 0
+    while slug in taken:  # e.g. "a_1" taken by the literal text "a 1"
+        count += 1
+        slug = f"{base}_{count}"
+    return slug
+
+def refresh_order(name: str) -> None:
+    """Rebuild ``<name>_order`` after adding/removing keys of that dict."""
+    st.session_state[f"{name}_order"] = list(st.session_state[name])
+
+def filter_keys(name: str, text: str) -> list[str]:
+    """Keys of ``<name>_order`` whose label contains ``text`` (case-insensitive).
+
+    Labels are batch names for ``"batches"`` and the keys themselves otherwise;
+    the lowercased labels are memoized per data revision.
+    """
+    order = st.session_state[f"{name}_order"]
+    ft = text.lower()
+    if not ft:
+        return list(order)
+    if name == "batches":
+        labels = lambda: [(bid, st.session_state.batches[bid]["name"].lower()) for bid in order]
+    else:
+        labels = lambda: [(k, k.lower()) for k in order]
+    return [k for k, low in _rev_memo(("lower", name), labels) if ft in low]
 
 def _new_batch_id() -> str:
     bid = f"b{st.session_state.batch_id_counter}"
     st.session_state.batch_id_counter += 1
     return bid
 
-def batch_portions_yield(batch: dict, densities: dict) -> int:
+# Cache dei calcoli: firme veloci (pickle + xxh3) come chiavi di st.cache_data ---
+# Cached functions receive an int signature of each input plus the data itself
+# as an underscore-prefixed argument, which st.cache_data does not hash.
+# (Alternative: @st.cache_data(hash_funcs={dict: _sig}) on the data arguments.)
+def _sig(obj) -> int:
+    """Fast content signature: C-level pickle dump hashed with xxh3 (or BLAKE2b)."""
+    return _digest64(pickle.dumps(obj, protocol=5))
+
+def _ingredient_soa():
+    """Catalog SoA columns; rebuilt by ``save_state("ingredients", ...)``."""
+    soa = st.session_state.get("_ing_soa")
+    if soa is None:
+        soa = st.session_state["_ing_soa"] = ingredient_soa(st.session_state.ingredients)
+    return soa
+
+def _density_soa():
+    """Density column; rebuilt by ``save_state("densities", ...)``."""
+    dsoa = st.session_state.get("_dens_soa")
+    if dsoa is None:
+        dsoa = st.session_state["_dens_soa"] = density_soa(st.session_state.densities)
+    return dsoa
+
+def _rev_memo(key, compute):
+    """Return ``compute()`` memoized in session_state until ``data_rev`` changes.
+
+    ``data_rev`` is bumped by every ``save_state`` that actually writes, and
+    every edit of the persisted dicts is followed by one.
+    """
+    rev = st.session_state.get("data_rev", 0)
+    memo = st.session_state.get("_rev_memo")
+    if memo is None or memo[0] != rev:
+        memo = st.session_state["_rev_memo"] = (rev, {})
+    table = memo[1]
+    if key not in table:
+        table[key] = compute()
+    return table[key]
+
+def _compute_state_sig() -> int:
+    """Signature of recipes, batches, catalog and densities: changes on any edit."""
+    return _rev_memo("state_sig", lambda: _sig((
+        st.session_state.recipes, st.session_state.batches,
+        st.session_state.ingredients, st.session_state.densities,
+    )))
+
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def _batch_summary_cached(items_sig: int, ingredients_sig: int, densities_sig: int,
+                          _items: list, _ingredients: dict, _densities: dict, _soa, _dsoa) -> tuple:
+    cost, weight, unknown = batch_summary({"items": _items}, _ingredients, _densities, _soa, _dsoa)
+    missing = ", ".join(sorted({it.name for it in _items} - _ingredients.keys()))
+    return cost, weight, unknown, missing
+
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def _pie_data(items_sig: int, ingredients_sig: int, _items: list, _ingredients: dict) -> tuple[tuple, tuple]:
+    """Return ``(labels, values)``: cost of each priced ingredient in the batch."""
+    uc = unit_costs(_ingredients)
+    factor_of = UNIT_FACTOR.get
+    priced = [(n, uc[n] * factor_of(u, 1.0) * q) for n, q, u in _items if n in uc]
+    return tuple(n for n, _ in priced), tuple(v for _, v in priced)
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def _pie_png(labels: tuple, vals: tuple) -> bytes:
+    """Render the cost pie once per distinct breakdown and return it as PNG bytes."""
+    # import lazily: only this chart needs matplotlib
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(3, 3), dpi=80)
+    ax.pie(vals, labels=labels, autopct='%1.1f%%', startangle=90)
+    ax.axis('equal')
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", bbox_inches="tight")
+    plt.close(fig)
+    return buf.getvalue()
+
+
+def summarize_batch(batch: dict, ingredients: dict, densities: dict) -> tuple[float, float, int, str]:
+    """Memoized ``(cost, weight_kg, unknown_density, missing_names)`` in one pass."""
+    items = batch.get("items", [])
+    return _batch_summary_cached(
+        _sig(items), _sig(ingredients), _sig(densities), items, ingredients, densities,
+        _ingredient_soa() if ingredients is st.session_state.ingredients else None,
+        _density_soa() if densities is st.session_state.densities else None,
+    )
+
+
+def _ceil_step(x: float, step: float) -> float:
+    """Round the price ``x`` up to a multiple of ``step``, in integer cents.
+
+    Working in cents keeps steps like 0.10 exact (``0.1 + 0.2`` no longer rounds
+    up to 0.4). Fractional cents still round up; only float noise below 1e-6
+    of a cent is dropped first.
+    """
+    step_cents = round(step * 100)
+    cents = math.ceil(round(x * 100, 6))
+    return -(-cents // step_cents) * step_cents / 100.0
+
+
+def batch_portions_yield(batch: dict, tot_w: float) -> int:
     pw = float(batch.get("portion_weight_g") or 0.0)
     if pw <= 0:
         return 0
-    tot_w, _ = batch_total_weight_kg(batch, densities)
-    return max(floor((tot_w * 1000.0) / pw), 0)
+    return max(int((tot_w * 1000.0) // pw), 0)
 
 
-def batch_cost_per_portion(batch: dict, ingredients: dict, densities: dict) -> float | None:
-    try:
-        total = batch_total_cost(batch, ingredients)
-    except ValueError as e:
-        st.warning(f"Unknown ingredients: {e}")
-        return None
-    portions = batch_portions_yield(batch, densities)
+def batch_cost_per_portion(batch: dict, ingredients: dict, densities: dict) -> tuple[float | None, str]:
+    """Return ``(cost_per_portion, missing_names)`` without touching the UI."""
+    total, tot_w, _, missing = summarize_batch(batch, ingredients, densities)
+    if missing:
+        return None, missing
+    portions = batch_portions_yield(batch, tot_w)
     if portions <= 0:
-        return None
-    return total / portions
+        return None, ""
+    return total / portions, ""
 
 
-def toppings_cost_per_portion(recipe: dict, ingredients: dict) -> float:
-    total = 0.0
-    for it in recipe.get("items", []):
-        if it["name"] not in ingredients:
-            continue
-        total += unit_cost(it["name"], ingredients) * to_base(float(it["qty"]), it["unit"])
-    return total / max(recipe.get("portions", 1), 1)
+def toppings_cost_per_portion(recipe: dict, soa) -> float:
+    """Extra-ingredient cost per portion, priced from the catalog SoA."""
+    return items_cost(recipe.get("items", []), soa) / max(recipe.get("portions", 1), 1)
 
-def recipe_cost_per_pizza(recipe_name: str) -> float:
+
+def _recipe_cost(recipe_name: str) -> float:
     r = st.session_state.recipes[recipe_name]
     bcost = 0.0
     for bu in r.get("batch_uses", []):
-        b = st.session_state.batches.get(bu["batch_id"])
+        bid = bu["batch_id"]
+        b = st.session_state.batches.get(bid)
         if not b:
             continue
-        cpp = batch_cost_per_portion(
+        # batches shared by several recipes are costed once per data revision
+        cpp, missing = _rev_memo(("cpp", bid), lambda: batch_cost_per_portion(
             b, st.session_state.ingredients, st.session_state.densities
-        )
+        ))
+        if missing:
+            st.warning(f"Unknown ingredients: {missing}")
         if cpp is not None:
-            bcost += cpp * float(bu.get("portions", 0) or 0)
-    return bcost + toppings_cost_per_portion(r, st.session_state.ingredients)
+            bcost += cpp * (bu.get("portions") or 0.0)
+    return bcost + toppings_cost_per_portion(r, _ingredient_soa())
+
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def _recipe_cost_cached(recipe_name: str, state_sig: int) -> float:
+    # state_sig is only part of the cache key: it changes whenever the data does
+    return _recipe_cost(recipe_name)
+
+def recipe_cost_per_pizza(recipe_name: str) -> float:
+    return _recipe_cost_cached(recipe_name, _compute_state_sig())
+
+def _format_currency_fallback(amount, currency, locale="en_US"):
+    symbol = "€" if currency == "EUR" else "$"
+    return f"{symbol}{amount:,.2f}"
 
-def format_money(x, cur):
-    if x is None:
-        return "—"
+@functools.lru_cache(maxsize=32)
+def _currency_formatter(locale: str):
+    """Return ``(format_currency, locale)``; Babel is imported and the locale parsed on first use."""
+    try:
+        from babel import Locale
+        from babel.numbers import format_currency
+    except Exception:  # pragma: no cover - fallback if Babel missing
+        return _format_currency_fallback, locale
+    return format_currency, Locale.parse(locale)
+
+# en_US (default): stessa resa di Babel senza passare dal CLDR
+_EN_US_SYMBOLS = {"EUR": "€", "USD": "$"}
+_CENT = Decimal("0.01")
+
+def _format_en_us(x, symbol: str) -> str:
+    # Babel rounds the decimal repr half-even, so do the same rather than f"{x:,.2f}"
+    d = Decimal(str(x)).quantize(_CENT, ROUND_HALF_EVEN)
+    return f"{'-' if d.is_signed() else ''}{symbol}{abs(d):,.2f}"
+
+def make_money_formatter(cur: str):
+    """Return ``fmt(x)`` with currency and locale bound once per page render."""
     locale = st.session_state.get("locale", "en_US")
-    return format_currency(x, cur, locale=locale)
+    symbol = _EN_US_SYMBOLS.get(cur) if locale == "en_US" else None
+    if symbol is not None:
+        def fmt_en_us(x):
+            if x is None:
+                return "—"
+            if not math.isfinite(x):  # inf/NaN: Decimal.quantize can't render these like Babel
+                format_currency, loc = _currency_formatter(locale)
+                return format_currency(x, cur, locale=loc)
+            return _format_en_us(x, symbol)
+        return fmt_en_us
+    format_currency, locale = _currency_formatter(locale)
+
+    def fmt(x):
+        if x is None:
+            return "—"
+        return format_currency(x, cur, locale=locale)
+    return fmt
+
+def _batch_labels() -> dict[str, str]:
+    labels = {}
+    for bid, b in st.session_state.batches.items():
+        cat = b.get("category", "").strip()
+        labels[bid] = f"{b.get('name','?')} ({cat}) [{bid}]" if cat else f"{b.get('name','?')} [{bid}]"
+    return labels
 
 def batch_label(bid: str) -> str:
-    b = st.session_state.batches[bid]
-    cat = f" ({b.get('category','').strip()})" if b.get("category","").strip() else ""
-    return f"{b.get('name','?')}{cat} [{bid}]"
+    """Selectbox ``format_func``: labels are built once per data revision."""
+    return _rev_memo("batch_labels", _batch_labels)[bid]
 
 # Nome libero + creazione inline ingrediente nel catalogo
 def ingredient_inline_creator(name_key: str, prefix: str = "") -> str | None:
@@ -205,7 +644,8 @@ def ingredient_inline_creator(name_key: str, prefix: str = "") -> str | None:
     if name in st.session_state.ingredients:
         st.caption("Using catalog price for this ingredient.")
         return name
-    safe_name = unique_slug(name)
+    taken = _rev_memo("ingredient_slugs", lambda: {slugify(n) for n in st.session_state.ingredients})
+    safe_name = unique_slug(name, taken)
     st.warning("This ingredient is not in the catalog yet. Add it now to compute costs.")
     with st.expander("Add to catalog now ➕", expanded=True):
         base_unit = st.selectbox("Base unit for pricing", ["kg", "L"], key=f"{prefix}new_ing_unit_{safe_name}")
@@ -224,6 +664,7 @@ def ingredient_inline_creator(name_key: str, prefix: str = "") -> str | None:
                 "package_price": float(pack_price)
             }
             save_state("ingredients", st.session_state.ingredients)
+            refresh_order("ingredients")
             if dens is not None:
                 st.session_state.densities[name] = float(dens)
                 save_state("densities", st.session_state.densities)
@@ -231,22 +672,18 @@ def ingredient_inline_creator(name_key: str, prefix: str = "") -> str | None:
             st.rerun()
     return None
 
-# -----------------------------------------------------------------------------
-# UI — sidebar navigation
-# -----------------------------------------------------------------------------
-sections = ["Food Cost (Home)", "Menu (soon)", "Recipes", "Batches", "Ingredients", "Settings"]
-page = st.sidebar.selectbox("Navigate", sections, key="nav")
-
 # -----------------------------------------------------------------------------
 # HOME
 # -----------------------------------------------------------------------------
-if page == "Food Cost (Home)":
+@st.fragment
+def _render_home():
     st.header("Food Cost — Caveman Mode")
     if not st.session_state.recipes:
         st.info("No recipes yet. Create one in the 'Recipes' tab.")
     else:
-        rsel = st.selectbox("Recipe", list(st.session_state.recipes.keys()), key="home_recipe")
+        rsel = st.selectbox("Recipe", st.session_state.recipes_order, key="home_recipe")
         currency = st.selectbox("Currency", ["EUR", "USD"], key="home_currency")
+        fmt = make_money_formatter(currency)
         tax_pct = st.number_input("Tax % (VAT/Sales Tax)", 0.0, 50.0, 9.0, 0.5, key="home_taxpct")
         target_fc = st.slider("Target Food-Cost %", 20, 40, 30, key="home_targetfc") / 100.0
         step = st.selectbox("Rounding step", [0.10, 0.50, 1.00], index=1, key="home_roundstep")
@@ -256,26 +693,31 @@ if page == "Food Cost (Home)":
         sell_net = sell_gross / (1.0 + tax_pct/100.0) if sell_gross > 0 else 0.0
         current_fc = (cpp / sell_net) if sell_net > 0 else 0.0
         rec_net = cpp / max(target_fc, 1e-9)
-        rec_gross = ceil((rec_net * (1.0 + tax_pct/100.0)) / step) * step
+        rec_gross = _ceil_step(rec_net * (1.0 + tax_pct/100.0), step)
         margin_now = sell_net - cpp
 
-        st.metric("Cost per portion", format_money(cpp, currency))
+        st.metric("Cost per portion", fmt(cpp))
         st.metric("Current Food-Cost", f"{current_fc*100:,.1f}%")
-        st.metric("Recommended Price (GROSS)", format_money(rec_gross, currency))
-        st.metric("Margin now (net)", format_money(margin_now, currency))
+        st.metric("Recommended Price (GROSS)", fmt(rec_gross))
+        st.metric("Margin now (net)", fmt(margin_now))
+
 
 # -----------------------------------------------------------------------------
 # MENU (placeholder)
 # -----------------------------------------------------------------------------
-if page == "Menu (soon)":
+@st.fragment
+def _render_menu():
     st.header("Menu (Dynamic) — coming next")
     st.info("Tabella con tutte le ricette, prezzi e margini live (prossima iterazione).")
 
+
 # -----------------------------------------------------------------------------
 # RECIPES
 # -----------------------------------------------------------------------------
-if page == "Recipes":
+@st.fragment
+def _render_recipes():
     st.header("Recipes")
+    fmt = make_money_formatter("EUR")
     st.subheader("Create new recipe")
     with st.form("create_recipe_form"):
         new_name = st.text_input("Recipe name", key="recipes_new_name")
@@ -289,13 +731,14 @@ if page == "Recipes":
             else:
                 st.session_state.recipes[new_name] = {"portions": int(new_portions), "batch_uses": [], "items": []}
                 save_state("recipes", st.session_state.recipes)
+                refresh_order("recipes")
                 st.success("Recipe created")
                 st.rerun()
 
     st.divider()
 
     if st.session_state.recipes:
-        rsel = st.selectbox("Select recipe", list(st.session_state.recipes.keys()), key="recipes_view_recipe")
+        rsel = st.selectbox("Select recipe", st.session_state.recipes_order, key="recipes_view_recipe")
         r = st.session_state.recipes[rsel]
 
         colA, colB = st.columns([1, 1])
@@ -312,18 +755,17 @@ if page == "Recipes":
             st.subheader("Extra ingredients (per portion) 🧀")
             if r.get("items"):
                 for it in r["items"]:
-                    st.write(f"- {it['name']}: {it['qty']} {it['unit']}")
+                    st.write(f"- {it.name}: {it.qty} {it.unit}")
             else:
                 st.info("No extra ingredients.")
 
-            st.success(f"Cost per portion: {format_money(recipe_cost_per_pizza(rsel), 'EUR')}")
+            st.success(f"Cost per portion: {fmt(recipe_cost_per_pizza(rsel))}")
 
         with colB:
             st.subheader("Attach a batch ➕")
             if st.session_state.batches:
                 with st.form("attach_batch_form"):
-                    bf = st.session_state.get("batch_filter", "")
-                    options = [bid for bid in st.session_state.batches if bf.lower() in st.session_state.batches[bid]["name"].lower()]
+                    options = filter_keys("batches", st.session_state.get("batch_filter", ""))
                     bid_to_add = st.selectbox("Choose batch",
                                               options=options,
                                               format_func=batch_label,
@@ -334,6 +776,7 @@ if page == "Recipes":
                     if submitted:
                         r.setdefault("batch_uses", [])
                         r["batch_uses"].append({"batch_id": bid_to_add, "portions": float(pp)})
+                        st.session_state.batch_refs.setdefault(bid_to_add, set()).add(rsel)
                         save_state("recipes", st.session_state.recipes)
                         st.success("Batch attached")
                         st.rerun()
@@ -343,7 +786,7 @@ if page == "Recipes":
             st.markdown("---")
             st.subheader("Add extra ingredient (per portion) ➕")
             with st.form("add_extra_ing_form"):
-                ingr = st.selectbox("Ingredient (from catalog)", list(st.session_state.ingredients.keys()),
+                ingr = st.selectbox("Ingredient (from catalog)", st.session_state.ingredients_order,
                                     key="recipes_ingr_select")
                 qty = st.number_input("Qty", 0.0, value=0.10, step=0.01, key="recipes_qty")
                 unit = st.selectbox("Unit", ["kg", "g", "L", "ml"], key="recipes_unit")
@@ -353,7 +796,7 @@ if page == "Recipes":
                 del_btn = c3.form_submit_button("Delete recipe")
                 if add_btn:
                     r.setdefault("items", [])
-                    r["items"].append({"name": ingr, "qty": qty, "unit": unit})
+                    r["items"].append(Item(ingr, float(qty), unit))
                     save_state("recipes", st.session_state.recipes)
                     st.success("Ingredient added")
                     st.rerun()
@@ -364,18 +807,23 @@ if page == "Recipes":
                         st.warning("Removed last")
                         st.rerun()
                 if del_btn:
+                    for bu in r.get("batch_uses", []):
+                        st.session_state.batch_refs.get(bu["batch_id"], set()).discard(rsel)
                     st.session_state.recipes.pop(rsel, None)
                     save_state("recipes", st.session_state.recipes)
+                    refresh_order("recipes")
                     st.warning("Recipe deleted")
                     st.rerun()
 
+
 # -----------------------------------------------------------------------------
 # BATCHES — pannello EDIT (sinistra) + pannello NEW (destra) ben distinti
 # -----------------------------------------------------------------------------
-if page == "Batches":
+@st.fragment
+def _render_batches(batch_filter: str):
     st.header("Batches")
+    fmt = make_money_formatter("EUR")
 
-    batch_filter = st.sidebar.text_input("Filter batches", key="batch_filter")
     colL, colR = st.columns([1, 1])
 
     # -------------------- EDIT SELECTED --------------------
@@ -384,20 +832,21 @@ if page == "Batches":
         if not st.session_state.batches:
             st.info("No batches yet. Create one on the right.")
         else:
-            options = [bid for bid in st.session_state.batches if batch_filter.lower() in st.session_state.batches[bid]["name"].lower()]
+            options = filter_keys("batches", batch_filter)
             bid_sel = st.selectbox("Select batch",
                                    options=options,
                                    format_func= batch_label,
                                    key="b_sel")
             b = st.session_state.batches[bid_sel]
+            kp = f"b_{bid_sel}_"  # prefisso unico per le chiavi dei widget di questo batch
 
             # Sezione base
             st.markdown("#### Basic 📄")
-            b["name"] = st.text_input("Batch name (free text)", value=b.get("name",""), key=f"b_name_{bid_sel}")
-            b["category"] = st.text_input("Category (free text)", value=b.get("category",""), key=f"b_cat_{bid_sel}")
+            b["name"] = st.text_input("Batch name (free text)", value=b.get("name",""), key=kp + "name")
+            b["category"] = st.text_input("Category (free text)", value=b.get("category",""), key=kp + "cat")
             b["portion_weight_g"] = st.number_input("Portion weight (g)", 1.0,
                                                     value=float(b.get("portion_weight_g") or 280.0),
-                                                    step=10.0, key=f"b_pw_{bid_sel}")
+                                                    step=10.0, key=kp + "pw")
             save_state("batches", st.session_state.batches)
 
             st.divider()
@@ -406,15 +855,15 @@ if page == "Batches":
             st.markdown("#### Ingredients in this batch (TOTAL quantities) 🧾")
             if b.get("items"):
                 for it in b["items"]:
-                    st.write(f"- {it['name']}: {it['qty']} {it['unit']}")
+                    st.write(f"- {it.name}: {it.qty} {it.unit}")
             else:
                 st.info("No items yet.")
 
             st.markdown("##### Add ingredient to this batch ➕")
-            with st.form(f"b_add_form_{bid_sel}"):
-                name_ok_e = ingredient_inline_creator(name_key=f"edit_ing_name_{bid_sel}", prefix=f"b_{bid_sel}_")
-                qty_e = st.number_input("Qty (total in batch)", 0.0, value=0.5, step=0.1, key=f"b_add_qty_{bid_sel}")
-                unit_e = st.selectbox("Unit", ["kg", "g", "L", "ml"], key=f"b_add_unit_{bid_sel}")
+            with st.form(kp + "add_form"):
+                name_ok_e = ingredient_inline_creator(name_key="edit_ing_name", prefix=kp)
+                qty_e = st.number_input("Qty (total in batch)", 0.0, value=0.5, step=0.1, key=kp + "add_qty")
+                unit_e = st.selectbox("Unit", ["kg", "g", "L", "ml"], key=kp + "add_unit")
                 ec1, ec2 = st.columns([1, 1])
                 add_btn = ec1.form_submit_button("Add item")
                 rem_btn = ec2.form_submit_button("Remove last item")
@@ -423,7 +872,7 @@ if page == "Batches":
                         st.error("Please add the ingredient to catalog first (see above).")
                     else:
                         b.setdefault("items", [])
-                        b["items"].append({"name": name_ok_e, "qty": qty_e, "unit": unit_e})
+                        b["items"].append(Item(name_ok_e, float(qty_e), unit_e))
                         save_state("batches", st.session_state.batches)
                         st.success("Item added")
                         st.rerun()
@@ -438,43 +887,35 @@ if page == "Batches":
 
             # Riepilogo + grafico a torta
             st.markdown("#### Batch Summary 📊")
-            try:
-                total_cost = batch_total_cost(b, st.session_state.ingredients)
-            except ValueError as e:
-                st.warning(f"Unknown ingredients: {e}")
-                total_cost = 0.0
-            total_w, unknown = batch_total_weight_kg(b, st.session_state.densities)
-            portions = batch_portions_yield(b, st.session_state.densities)
-            cpp = batch_cost_per_portion(
+            total_cost, total_w, unknown, missing = summarize_batch(
                 b, st.session_state.ingredients, st.session_state.densities
             )
+            portions = batch_portions_yield(b, total_w)
+            cpp = None
+            if missing:
+                st.warning(f"Unknown ingredients: {missing}")
+                total_cost = 0.0
+            elif portions > 0:
+                cpp = total_cost / portions
             cpkg = (total_cost / total_w) if total_w > 0 else None
 
             m1, m2, m3 = st.columns(3)
-            m1.metric("Total cost", format_money(total_cost, "EUR"))
+            m1.metric("Total cost", fmt(total_cost))
             m2.metric("Total weight", f"{total_w:.3f} kg")
             m3.metric("Est. portions", f"{portions:d}" if portions else "—")
             m1, m2 = st.columns(2)
-            m1.metric("Cost / portion", format_money(cpp, "EUR"))
-            m2.metric("Cost / kg", format_money(cpkg, "EUR"))
+            m1.metric("Cost / portion", fmt(cpp))
+            m2.metric("Cost / kg", fmt(cpkg))
             if unknown > 0:
                 st.warning(f"{unknown} volume ingredient(s) missing density → excluded from weight.")
 
             # 🥧 pie chart: costo per ingrediente
-            cost_labels, cost_vals = [], []
-            for it in b.get("items", []):
-                if it["name"] in st.session_state.ingredients:
-                    cost_labels.append(it["name"])
-                    cost_vals.append(
-                        unit_cost(it["name"], st.session_state.ingredients)
-                        * to_base(float(it["qty"]), it["unit"])
-                    )
+            items = b.get("items", [])
+            cost_labels, cost_vals = _pie_data(
+                _sig(items), _sig(st.session_state.ingredients), items, st.session_state.ingredients
+            )
             if sum(cost_vals) > 0:
-                fig, ax = plt.subplots()
-                ax.pie(cost_vals, labels=cost_labels, autopct='%1.1f%%', startangle=90)
-                ax.axis('equal')
-                st.pyplot(fig)
-                plt.close(fig)
+                st.image(_pie_png(cost_labels, cost_vals))
                 st.caption("Pie chart of cost distribution per ingredient")
                 total_val = sum(cost_vals)
                 for lbl, val in zip(cost_labels, cost_vals):
@@ -483,13 +924,15 @@ if page == "Batches":
                 st.info("Add priced ingredients to see the cost breakdown pie chart.")
 
             st.divider()
-            if st.button("Delete this batch 🗑️", key=f"b_del_{bid_sel}"):
-                for rn, rdict in st.session_state.recipes.items():
-                    if rdict.get("batch_uses"):
+            if st.button("Delete this batch 🗑️", key=kp + "del"):
+                for rn in st.session_state.batch_refs.pop(bid_sel, ()):
+                    rdict = st.session_state.recipes.get(rn)
+                    if rdict and rdict.get("batch_uses"):
                         rdict["batch_uses"] = [bu for bu in rdict["batch_uses"] if bu.get("batch_id") != bid_sel]
                 save_state("recipes", st.session_state.recipes)
                 st.session_state.batches.pop(bid_sel, None)
                 save_state("batches", st.session_state.batches)
+                refresh_order("batches")
                 st.warning("Batch deleted (also removed from recipes)")
                 st.rerun()
 
@@ -510,7 +953,7 @@ if page == "Batches":
         st.markdown("#### Ingredients in NEW batch (TOTAL quantities) 🧾")
         if nb.get("items"):
             for it in nb["items"]:
-                st.write(f"- {it['name']}: {it['qty']} {it['unit']}")
+                st.write(f"- {it.name}: {it.qty} {it.unit}")
         else:
             st.info("No items yet.")
 
@@ -527,7 +970,7 @@ if page == "Batches":
                     st.error("Please add the ingredient to catalog first (see above).")
                 else:
                     nb.setdefault("items", [])
-                    nb["items"].append({"name": name_ok, "qty": qty_val, "unit": unit_val})
+                    nb["items"].append(Item(name_ok, float(qty_val), unit_val))
                     st.success("Item added")
                     st.rerun()
             if rem_btn:
@@ -538,25 +981,25 @@ if page == "Batches":
 
         st.divider()
 
-        try:
-            tmp_cost = batch_total_cost(nb, st.session_state.ingredients)
-        except ValueError as e:
-            st.warning(f"Unknown ingredients: {e}")
-            tmp_cost = 0.0
-        tmp_w, tmp_unknown = batch_total_weight_kg(nb, st.session_state.densities)
-        tmp_portions = batch_portions_yield(nb, st.session_state.densities)
-        tmp_cpp = batch_cost_per_portion(
+        tmp_cost, tmp_w, tmp_unknown, tmp_missing = summarize_batch(
             nb, st.session_state.ingredients, st.session_state.densities
         )
+        tmp_portions = batch_portions_yield(nb, tmp_w)
+        tmp_cpp = None
+        if tmp_missing:
+            st.warning(f"Unknown ingredients: {tmp_missing}")
+            tmp_cost = 0.0
+        elif tmp_portions > 0:
+            tmp_cpp = tmp_cost / tmp_portions
         tmp_cpkg = (tmp_cost / tmp_w) if tmp_w > 0 else None
 
         m1, m2, m3 = st.columns(3)
-        m1.metric("Total cost", format_money(tmp_cost, "EUR"))
+        m1.metric("Total cost", fmt(tmp_cost))
         m2.metric("Total weight", f"{tmp_w:.3f} kg")
         m3.metric("Est. portions", f"{tmp_portions:d}" if tmp_portions else "—")
         m1, m2 = st.columns(2)
-        m1.metric("Cost / portion", format_money(tmp_cpp, "EUR"))
-        m2.metric("Cost / kg", format_money(tmp_cpkg, "EUR"))
+        m1.metric("Cost / portion", fmt(tmp_cpp))
+        m2.metric("Cost / kg", fmt(tmp_cpkg))
         if tmp_unknown > 0:
             st.warning(f"{tmp_unknown} volume ingredient(s) missing density → excluded from weight.")
 
@@ -574,38 +1017,44 @@ if page == "Batches":
                     "items": list(nb.get("items", []))
                 }
                 save_state("batches", st.session_state.batches)
+                refresh_order("batches")
                 st.session_state.new_batch_buffer = {"name": "", "category": "", "portion_weight_g": 280.0, "items": []}
                 st.success(f"Batch created: {st.session_state.batches[bid]['name']} [{bid}]")
                 st.rerun()
 
+
 # -----------------------------------------------------------------------------
 # INGREDIENTS
 # -----------------------------------------------------------------------------
-if page == "Ingredients":
+@st.fragment
+def _render_ingredients(filter_txt: str):
     st.header("Ingredients (package-based pricing)")
+    fmt = make_money_formatter("EUR")
     st.caption("Enter package size + package price; the app computes unit cost automatically.")
-    filter_txt = st.sidebar.text_input("Filter ingredients", key="ing_filter")
 
-    names = [n for n in st.session_state.ingredients if filter_txt.lower() in n.lower()]
-    for name in names:
+    # un solo pannello di modifica: widget O(1) invece di un expander per ingrediente
+    names = filter_keys("ingredients", filter_txt)
+    if not names:
+        st.info("No ingredients match the filter.")
+    else:
+        name = st.selectbox("Edit ingredient", names, key="ing_edit_sel")
         d = st.session_state.ingredients[name]
-        with st.expander(name, expanded=False):
-            d["unit"] = st.selectbox(
-                f"{name} unit", ["kg", "L"],
-                index=0 if d["unit"] == "kg" else 1, key=f"ing_unit_{name}"
-            )
-            d["package_qty"] = st.number_input(
-                f"{name} package size ({d['unit']})",
-                min_value=0.0001, value=float(d["package_qty"]),
-                step=0.1, key=f"ing_qty_{name}"
-            )
-            d["package_price"] = st.number_input(
-                f"{name} package price",
-                min_value=0.0, value=float(d["package_price"]),
-                step=0.10, key=f"ing_price_{name}"
-            )
-            unit_cost_val = d["package_price"] / max(d["package_qty"], 1e-9)
-            st.info(f"Computed unit cost: {format_money(unit_cost_val, 'EUR')}/{d['unit']}")
+        d["unit"] = st.selectbox(
+            f"{name} unit", ["kg", "L"],
+            index=0 if d["unit"] == "kg" else 1, key=f"ing_unit_{name}"
+        )
+        d["package_qty"] = st.number_input(
+            f"{name} package size ({d['unit']})",
+            min_value=0.0001, value=float(d["package_qty"]),
+            step=0.1, key=f"ing_qty_{name}"
+        )
+        d["package_price"] = st.number_input(
+            f"{name} package price",
+            min_value=0.0, value=float(d["package_price"]),
+            step=0.10, key=f"ing_price_{name}"
+        )
+        unit_cost_val = unit_cost(name, st.session_state.ingredients)
+        st.info(f"Computed unit cost: {fmt(unit_cost_val)}/{d['unit']}")
     save_state("ingredients", st.session_state.ingredients)
 
     st.divider()
@@ -619,15 +1068,18 @@ if page == "Ingredients":
                 else:
                     st.session_state.ingredients[new_in] = {"unit": "kg", "package_qty": 1.0, "package_price": 1.0}
                     save_state("ingredients", st.session_state.ingredients)
+                    refresh_order("ingredients")
                     st.success("Ingredient added")
                     st.rerun()
             else:
                 st.error("Please enter an ingredient name")
 
+
 # -----------------------------------------------------------------------------
 # SETTINGS
 # -----------------------------------------------------------------------------
-if page == "Settings":
+@st.fragment
+def _render_settings():
     st.header("Settings")
     st.caption("Future: export CSV/PDF, backend licenze, densità editabili in UI, tema.")
 
@@ -636,11 +1088,14 @@ if page == "Settings":
     st.session_state["locale"] = loc
 
     st.subheader("Densities (kg/L)")
-    for name, val in list(st.session_state.densities.items()):
-        st.session_state.densities[name] = st.number_input(
-            f"{name} density", min_value=0.0001, value=float(val), step=0.01, key=f"dens_{name}"
-        )
-    save_state("densities", st.session_state.densities)
+    prev = st.session_state.densities
+    new = {
+        name: st.number_input(f"{name} density", min_value=0.0001, value=float(val), step=0.01, key=f"dens_{name}")
+        for name, val in prev.items()
+    }
+    if new != prev:  # salva solo se una densità è cambiata davvero
+        st.session_state.densities = new
+        save_state("densities", new)
 
     new_dens_name = st.text_input("Add density for ingredient", key="dens_new_name")
     new_dens_val = st.number_input("Density value", min_value=0.0001, value=1.0, step=0.01, key="dens_new_val")
@@ -655,7 +1110,37 @@ if page == "Settings":
 
     st.markdown("---")
     if st.button("Reset all data (ingredients, recipes, batches)", key="settings_reset"):
-        for k in ("ingredients", "recipes", "batches", "new_batch_buffer"):
+        for k in ("ingredients", "recipes", "batches", "new_batch_buffer",
+                  "ingredients_order", "recipes_order", "batches_order", "batch_refs",
+                  "_rev_memo", "_ing_soa"):
             if k in st.session_state:
                 del st.session_state[k]
         st.rerun()
+
+
+# -----------------------------------------------------------------------------
+# UI — sidebar navigation
+# -----------------------------------------------------------------------------
+def main() -> None:
+    _license_gate()
+    init_session_state()
+    sections = ["Food Cost (Home)", "Menu (soon)", "Recipes", "Batches", "Ingredients", "Settings"]
+    page = st.sidebar.selectbox("Navigate", sections, key="nav")
+    if page == "Food Cost (Home)":
+        _render_home()
+    elif page == "Menu (soon)":
+        _render_menu()
+    elif page == "Recipes":
+        _render_recipes()
+    elif page == "Batches":
+        batch_filter = st.sidebar.text_input("Filter batches", key="batch_filter")
+        _render_batches(batch_filter)
+    elif page == "Ingredients":
+        filter_txt = st.sidebar.text_input("Filter ingredients", key="ing_filter")
+        _render_ingredients(filter_txt)
+    elif page == "Settings":
+        _render_settings()
+
+
+if __name__ == "__main__":
+    main()
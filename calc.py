@@ -1,61 +1,306 @@
 """Pure calculation utilities for food cost logic."""
 
-from typing import Dict, Tuple, Any
+from typing import Dict, List, NamedTuple, Optional, Tuple, Any
+
+import numpy as np
+
+try:  # optional JIT kernels
+    from calc_numba import (
+        sum_cost as _jit_sum_cost, weight_sum as _jit_weight_sum,
+        batch_totals as _jit_batch_totals, batch_totals_parallel as _jit_batch_totals_parallel,
+        recipe_costs as _jit_recipe_costs, THREADS as _jit_threads,
+    )
+except ImportError:  # pragma: no cover - numba not installed
+    _jit_sum_cost = _jit_weight_sum = _jit_batch_totals = _jit_batch_totals_parallel = _jit_recipe_costs = None
+    _jit_threads = 1
+
+# Below this many items thread start-up costs more than the parallel kernel saves.
+PARALLEL_MIN_ITEMS = 20_000
+
+# Unit encoding for the vectorized (SoA) batch paths; unknown units map to -1.
+UNIT_CODES = {"kg": 0, "g": 1, "L": 2, "ml": 3}
+# Base-unit scale indexed by unit code; the last entry serves code -1 (unknown unit, taken as-is).
+SCALE_TO_BASE = np.array([1.0, 1e-3, 1.0, 1e-3, 1.0])
+
+# Dispatch tables for scalar conversions (base unit is kg or L).
+UNIT_FACTOR = {"kg": 1.0, "g": 1e-3, "L": 1.0, "ml": 1e-3}
+_KG_FACTOR = {"kg": 1.0, "g": 1e-3}
+_VOL_FACTOR = {"L": 1.0, "ml": 1e-3}
+
+
+class Item(NamedTuple):
+    """One ingredient line of a batch or recipe (JSON-persisted as ``[name, qty, unit]``)."""
+    name: str
+    qty: float
+    unit: str
+
+
+def as_item(it: Any) -> Item:
+    """Coerce an ``Item``, a ``[name, qty, unit]`` list or a legacy dict to ``Item``.
+
+    ``Item``s pass through unchanged: the UI casts ``qty`` to float when it
+    builds one, and persisted rows are cast here on load.
+    """
+    if isinstance(it, Item):
+        return it
+    if isinstance(it, dict):
+        return Item(it["name"], float(it["qty"]), it["unit"])
+    name, qty, unit = it
+    return Item(name, float(qty), unit)
+
+
+class IngredientSoA(NamedTuple):
+    """Catalog as parallel columns; ``index`` maps an ingredient name to its row.
+
+    ``unit_cost`` carries one trailing 0.0 sentinel, so a missing name looked
+    up as index -1 prices at zero.
+    """
+    index: Dict[str, int]
+    package_qty: np.ndarray
+    package_price: np.ndarray
+    unit_cost: np.ndarray
+
+
+def ingredient_soa(ingredients: Dict[str, Dict[str, Any]]) -> IngredientSoA:
+    """Build the SoA view of the catalog (rebuild it whenever the catalog changes)."""
+    n = len(ingredients)
+    rows = ingredients.values()
+    package_qty = np.fromiter((d["package_qty"] for d in rows), dtype=np.float64, count=n)
+    package_price = np.fromiter((d["package_price"] for d in rows), dtype=np.float64, count=n)
+    unit_cost = np.append(package_price / np.maximum(package_qty, 1e-9), 0.0)
+    return IngredientSoA({nm: i for i, nm in enumerate(ingredients)}, package_qty, package_price, unit_cost)
+
+
+class DensitySoA(NamedTuple):
+    """Densities (kg/L) as one column; ``index`` maps a name to its row.
+
+    Like ``IngredientSoA.unit_cost`` the column ends with a 0.0 sentinel, so
+    names without a density (index -1) read 0.0, the "unknown" marker the
+    weight reductions already use.
+    """
+    index: Dict[str, int]
+    density: np.ndarray
+
+
+def density_soa(densities: Dict[str, float]) -> DensitySoA:
+    n = len(densities)
+    col = np.fromiter((d or 0.0 for d in densities.values()), dtype=np.float64, count=n)
+    return DensitySoA({nm: i for i, nm in enumerate(densities)}, np.append(col, 0.0))
+
+
+def update_ingredient_soa(soa: IngredientSoA, name: str, d: Dict[str, Any]) -> None:
+    """Refresh one existing row in place after its package values were edited."""
+    i = soa.index[name]
+    soa.package_qty[i] = d["package_qty"]
+    soa.package_price[i] = d["package_price"]
+    q = d["package_qty"]
+    soa.unit_cost[i] = d["package_price"] / (q if q > 1e-9 else 1e-9)
 
 
 def unit_cost(name: str, ingredients: Dict[str, Dict[str, Any]]) -> float:
-    """Compute unit cost for an ingredient from catalog data."""
+    """Compute unit cost for an ingredient from catalog data.
+
+    Package values are stored as floats (the UI casts them on insert), so no
+    casts here; the zero-size guard is a plain branch rather than a ``max()`` call.
+    """
     d = ingredients[name]
-    return float(d["package_price"]) / max(float(d["package_qty"]), 1e-9)
+    q = d["package_qty"]
+    return d["package_price"] / (q if q > 1e-9 else 1e-9)
+
+
+def unit_costs(ingredients: Dict[str, Dict[str, Any]]) -> Dict[str, float]:
+    """Unit cost (per kg or L) of every catalog ingredient, computed in one pass."""
+    out = {}
+    for n, d in ingredients.items():
+        q = d["package_qty"]
+        out[n] = d["package_price"] / (q if q > 1e-9 else 1e-9)
+    return out
 
 
 def to_base(qty: float, unit: str) -> float:
     """Convert quantity to base unit (kg or L)."""
-    if unit == "g":
-        return qty / 1000.0
-    if unit == "ml":
-        return qty / 1000.0
-    return qty
+    return qty * UNIT_FACTOR.get(unit, 1.0)
 
 
 def to_weight_kg(name: str, qty: float, unit: str, densities: Dict[str, float]) -> float:
     """Convert various units to kilograms using densities when needed."""
-    if unit == "kg":
-        return qty
-    if unit == "g":
-        return qty / 1000.0
-    if unit in ("L", "ml"):
-        dens = densities.get(name)
-        if not dens:
-            return 0.0
-        return dens * qty if unit == "L" else dens * qty / 1000.0
-    return 0.0
-
-
-def batch_total_cost(batch: Dict[str, Any], ingredients: Dict[str, Dict[str, Any]]) -> float:
+    factor = _KG_FACTOR.get(unit)
+    if factor is not None:
+        return qty * factor
+    factor = _VOL_FACTOR.get(unit)
+    if factor is None:
+        return 0.0
+    dens = densities.get(name)
+    if not dens:
+        return 0.0
+    return dens * qty * factor
+
+
+def _items_to_arrays(items: List[Any]) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """Split items into SoA columns: names, ``qty`` (float64), ``unit_code`` (int8)."""
+    if not items:
+        return [], np.empty(0, dtype=np.float64), np.empty(0, dtype=np.int8)
+    # one C-level transpose instead of a generator pass per column
+    names, qty, units = zip(*[it if isinstance(it, Item) else as_item(it) for it in items])
+    code_of = UNIT_CODES.get
+    unit_code = np.fromiter((code_of(u, -1) for u in units), dtype=np.int8, count=len(units))
+    return list(names), np.array(qty, dtype=np.float64), unit_code
+
+
+def _batch_to_arrays(batch: Dict[str, Any]) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    return _items_to_arrays(batch.get("items", []))
+
+
+def _price_column(
+    names: List[str], ingredients: Dict[str, Dict[str, Any]], soa: Optional[IngredientSoA] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Return ``(unit_price, valid)``; items missing from the catalog get price 0, valid False.
+
+    With ``soa`` the prices are gathered from its columns instead of the dicts.
+    """
+    n = len(names)
+    if soa is not None:
+        row_of = soa.index.get
+        idx = np.fromiter((row_of(nm, -1) for nm in names), dtype=np.intp, count=n)
+        return soa.unit_cost[idx], idx >= 0
+    # one division per distinct ingredient, however often the batch repeats it
+    uc = {nm: unit_cost(nm, ingredients) for nm in set(names) if nm in ingredients}
+    price_of = uc.get
+    # NaN marks names missing from the catalog, so one pass yields both columns
+    unit_price = np.fromiter((price_of(nm, np.nan) for nm in names), dtype=np.float64, count=n)
+    valid = ~np.isnan(unit_price)
+    unit_price[~valid] = 0.0
+    return unit_price, valid
+
+
+def _density_column(
+    names: List[str], densities: Dict[str, float], dsoa: Optional[DensitySoA] = None
+) -> np.ndarray:
+    if dsoa is not None:
+        row_of = dsoa.index.get
+        idx = np.fromiter((row_of(nm, -1) for nm in names), dtype=np.intp, count=len(names))
+        return dsoa.density[idx]
+    density_of = densities.get
+    return np.fromiter((density_of(nm) or 0.0 for nm in names), dtype=np.float64, count=len(names))
+
+
+def _cost_sum(qty: np.ndarray, unit_code: np.ndarray, unit_price: np.ndarray, valid: np.ndarray) -> float:
+    scale = SCALE_TO_BASE[unit_code]
+    if _jit_sum_cost is not None:
+        return float(_jit_sum_cost(qty, scale, unit_price, valid))
+    # unpriced items already carry price 0.0, so no mask is needed for the dot product
+    return float(np.dot(unit_price, qty * scale))
+
+
+def _weight_sum(qty: np.ndarray, unit_code: np.ndarray, density: np.ndarray) -> Tuple[float, int]:
+    if _jit_weight_sum is not None:
+        weight, unknown = _jit_weight_sum(qty, unit_code, density)
+        return float(weight), int(unknown)
+    scale = SCALE_TO_BASE[unit_code]
+    # volumes go through the density; unknown units weigh nothing
+    weight = qty * np.where(unit_code >= 2, scale * density, np.where(unit_code >= 0, scale, 0.0))
+    unknown = int(((unit_code >= 2) & (weight == 0.0)).sum())
+    return float(weight.sum()), unknown
+
+
+def items_cost(items: List[Any], soa: IngredientSoA) -> float:
+    """Total cost of ``items``; names missing from the catalog contribute nothing."""
+    names, qty, unit_code = _items_to_arrays(items)
+    unit_price, valid = _price_column(names, {}, soa)
+    return _cost_sum(qty, unit_code, unit_price, valid)
+
+
+def batch_total_cost(
+    batch: Dict[str, Any], ingredients: Dict[str, Dict[str, Any]], soa: Optional[IngredientSoA] = None
+) -> float:
     """Compute total batch cost given ingredient catalog.
 
     Raises:
         ValueError: if one or more ingredients are missing from the catalog.
     """
-    total = 0.0
-    missing = []
-    for it in batch.get("items", []):
-        if it["name"] not in ingredients:
-            missing.append(it["name"])
-            continue
-        total += unit_cost(it["name"], ingredients) * to_base(float(it["qty"]), it["unit"])
-    if missing:
-        raise ValueError(", ".join(sorted(set(missing))))
-    return total
+    names, qty, unit_code = _batch_to_arrays(batch)
+    unit_price, valid = _price_column(names, ingredients, soa)
+    if not valid.all():
+        raise ValueError(", ".join(sorted({nm for nm, ok in zip(names, valid) if not ok})))
+    return _cost_sum(qty, unit_code, unit_price, valid)
 
 
-def batch_total_weight_kg(batch: Dict[str, Any], densities: Dict[str, float]) -> Tuple[float, int]:
+def batch_total_weight_kg(
+    batch: Dict[str, Any], densities: Dict[str, float], dsoa: Optional[DensitySoA] = None
+) -> Tuple[float, int]:
     """Return total weight in kg and number of items lacking density info."""
-    w, unknown = 0.0, 0
-    for it in batch.get("items", []):
-        wk = to_weight_kg(it["name"], float(it["qty"]), it["unit"], densities)
-        if it["unit"] in ("L", "ml") and wk == 0.0:
-            unknown += 1
-        w += wk
-    return w, unknown
+    names, qty, unit_code = _batch_to_arrays(batch)
+    return _weight_sum(qty, unit_code, _density_column(names, densities, dsoa))
+
+
+def batch_summary(
+    batch: Dict[str, Any],
+    ingredients: Dict[str, Dict[str, Any]],
+    densities: Dict[str, float],
+    soa: Optional[IngredientSoA] = None,
+    dsoa: Optional[DensitySoA] = None,
+) -> Tuple[float, float, int]:
+    """Return ``(cost, weight_kg, unknown_density_count)`` from a single pass over the items.
+
+    Unlike ``batch_total_cost`` this does not raise: ingredients missing from
+    the catalog simply contribute no cost.
+    """
+    names, qty, unit_code = _batch_to_arrays(batch)
+    unit_price, valid = _price_column(names, ingredients, soa)
+    density = _density_column(names, densities, dsoa)
+    if _jit_batch_totals is not None:
+        parallel = _jit_threads > 1 and qty.size >= PARALLEL_MIN_ITEMS
+        kernel = _jit_batch_totals_parallel if parallel else _jit_batch_totals
+        cost, weight, unknown = kernel(qty, unit_code, unit_price, valid, density)
+        return float(cost), float(weight), int(unknown)
+    weight, unknown = _weight_sum(qty, unit_code, density)
+    return _cost_sum(qty, unit_code, unit_price, valid), weight, unknown
+
+
+def recipe_costs(
+    recipes: Dict[str, Dict[str, Any]], batch_cpp: Dict[str, Optional[float]], soa: IngredientSoA
+) -> Dict[str, float]:
+    """Cost per portion of every recipe in one pass (for the Menu table).
+
+    ``batch_cpp`` maps batch id to its cost per portion (None when unknown).
+    Uses of missing or unpriced batches, like unpriced toppings, add nothing.
+    """
+    # Flatten to CSR: recipe r owns items [item_offsets[r], item_offsets[r+1]).
+    n = len(recipes)
+    item_offsets = np.zeros(n + 1, dtype=np.intp)
+    use_offsets = np.zeros(n + 1, dtype=np.intp)
+    portions = np.empty(n, dtype=np.float64)
+    item_idx, item_qty_base, use_bid_idx, use_portions = [], [], [], []
+    missing = len(soa.index)          # row of the unit_cost zero sentinel
+    bid_index = {bid: i for i, bid in enumerate(batch_cpp)}
+    no_batch = len(bid_index)
+    # bound once: this loop runs over every item of every recipe
+    row_of, factor_of, bid_of = soa.index.get, UNIT_FACTOR.get, bid_index.get
+    add_idx, add_qty = item_idx.append, item_qty_base.append
+    add_bid, add_portions = use_bid_idx.append, use_portions.append
+    for r, rec in enumerate(recipes.values()):
+        for it in rec.get("items", []):
+            name, qty, unit = it if isinstance(it, Item) else as_item(it)
+            add_idx(row_of(name, missing))
+            add_qty(qty * factor_of(unit, 1.0))
+        for bu in rec.get("batch_uses", []):
+            add_bid(bid_of(bu["batch_id"], no_batch))
+            add_portions(bu.get("portions") or 0.0)
+        item_offsets[r + 1] = len(item_idx)
+        use_offsets[r + 1] = len(use_bid_idx)
+        portions[r] = max(rec.get("portions", 1), 1)
+    cpp = np.append(np.fromiter((v or 0.0 for v in batch_cpp.values()), dtype=np.float64, count=no_batch), 0.0)
+    item_idx = np.asarray(item_idx, dtype=np.intp)
+    item_qty_base = np.asarray(item_qty_base, dtype=np.float64)
+    use_bid_idx = np.asarray(use_bid_idx, dtype=np.intp)
+    use_portions = np.asarray(use_portions, dtype=np.float64)
+    if _jit_recipe_costs is not None:
+        out = _jit_recipe_costs(item_offsets, item_idx, item_qty_base, use_offsets, use_bid_idx,
+                                use_portions, cpp, soa.unit_cost, portions)
+    else:
+        owner = np.repeat(np.arange(n), np.diff(item_offsets))
+        toppings = np.bincount(owner, weights=item_qty_base * soa.unit_cost[item_idx], minlength=n)
+        owner = np.repeat(np.arange(n), np.diff(use_offsets))
+        batches = np.bincount(owner, weights=cpp[use_bid_idx] * use_portions, minlength=n)
+        out = batches + toppings / portions
+    return dict(zip(recipes, out.tolist()))
@@ -0,0 +1,126 @@
+"""Numba-compiled kernels for the calc hot loops.
+
+Optional: importing this module requires ``numba``; ``calc`` falls back to
+plain NumPy reductions when it is not installed.
+
+Kernels are compiled with ``cache=True`` and warmed up at import, so the JIT
+cost is paid once per machine. For cold-started deploys, prebuild the cache
+while building the image, e.g. ``NUMBA_CACHE_DIR=/app/.numba python -c
+"import calc_numba"``, and keep ``NUMBA_CACHE_DIR`` set at runtime.
+
+``batch_totals_parallel`` is not warmed up: it compiles, and starts numba's
+thread pool, on first use (batches of ``calc.PARALLEL_MIN_ITEMS`` items).
+Streamlit calls it off the main thread; if that hangs interpreter exit with
+the TBB layer, pick another one with ``NUMBA_THREADING_LAYER=omp``.
+"""
+
+import numpy as np
+from numba import config, njit, prange
+
+# threads available to ``prange`` kernels (1 on single-core hosts)
+THREADS = config.NUMBA_NUM_THREADS
+
+
+@njit(cache=True)
+def sum_cost(qty, scale, price, valid):
+    """Sum ``qty * scale * price`` over the items flagged in ``valid``."""
+    s = 0.0
+    for i in range(qty.size):
+        if valid[i]:
+            s += qty[i] * scale[i] * price[i]
+    return s
+
+
+@njit(cache=True)
+def weight_sum(qty, unit_code, density):
+    """Return ``(weight_kg, unknown)``; volume items without a density count as unknown."""
+    weight = 0.0
+    unknown = 0
+    for i in range(qty.size):
+        c = unit_code[i]
+        if c == 0:
+            weight += qty[i]
+        elif c == 1:
+            weight += qty[i] * 1e-3
+        elif c == 2 or c == 3:
+            w = qty[i] * (1e-3 if c == 3 else 1.0) * density[i]
+            if w == 0.0:
+                unknown += 1
+            weight += w
+    return weight, unknown
+
+
+@njit(cache=True)
+def batch_totals(qty, unit_code, price, valid, density):
+    """Fused cost/weight pass; unit codes follow ``calc.UNIT_CODES`` (kg, g, L, ml)."""
+    cost = 0.0
+    weight = 0.0
+    unknown = 0
+    for i in range(qty.size):
+        c = unit_code[i]
+        base = qty[i] * 1e-3 if (c == 1 or c == 3) else qty[i]
+        if valid[i]:
+            cost += base * price[i]
+        if c == 0 or c == 1:
+            weight += base
+        elif c == 2 or c == 3:
+            w = base * density[i]
+            if w == 0.0:
+                unknown += 1
+            weight += w
+    return cost, weight, unknown
+
+
+@njit(parallel=True, cache=True)
+def batch_totals_parallel(qty, unit_code, price, valid, density):
+    """``batch_totals`` split across threads; only worth it for very large batches."""
+    cost = 0.0
+    weight = 0.0
+    unknown = 0
+    for i in prange(qty.size):
+        c = unit_code[i]
+        base = qty[i] * 1e-3 if (c == 1 or c == 3) else qty[i]
+        if valid[i]:
+            cost += base * price[i]
+        if c == 0 or c == 1:
+            weight += base
+        elif c == 2 or c == 3:
+            w = base * density[i]
+            if w == 0.0:
+                unknown += 1
+            weight += w
+    return cost, weight, unknown
+
+
+@njit(cache=True)
+def recipe_costs(item_offsets, item_idx, item_qty_base, use_offsets, use_bid_idx,
+                 use_portions, batch_cpp, unit_cost, portions):
+    """Cost per portion of every recipe from CSR-flattened toppings and batch uses."""
+    n = item_offsets.size - 1
+    out = np.empty(n)
+    for r in range(n):
+        toppings = 0.0
+        for j in range(item_offsets[r], item_offsets[r + 1]):
+            toppings += item_qty_base[j] * unit_cost[item_idx[j]]
+        batches = 0.0
+        for j in range(use_offsets[r], use_offsets[r + 1]):
+            batches += batch_cpp[use_bid_idx[j]] * use_portions[j]
+        out[r] = batches + toppings / portions[r]
+    return out
+
+
+def _warmup():
+    """Compile (or load from the on-disk cache) every kernel at import time,
+    so the first Streamlit rerun does not pay the JIT cost."""
+    f = np.ones(1)
+    code = np.zeros(1, dtype=np.int8)
+    ok = np.ones(1, dtype=np.bool_)
+    idx = np.zeros(1, dtype=np.intp)
+    offsets = np.array([0, 1], dtype=np.intp)
+    sum_cost(f, f, f, ok)
+    weight_sum(f, code, f)
+    batch_totals(f, code, f, ok, f)
+    recipe_costs(offsets, idx, f, offsets, idx, f, f, f, f)
+
+
+_warmup()
@@ -0,0 +1,17 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+@pytest.fixture(scope="session")
+def app():
+    """The app module, imported once per test session.
+
+    app.py only builds the UI under ``__main__`` and reads ``APP_PASS`` at call
+    time, so tests can share the module and set the env per test.
+    """
+    import app as _app
+    return _app
@@ -1,24 +1,184 @@
-import importlib
-import sys
-from pathlib import Path
+import sqlite3
+import threading
 
+import pytest
 
-def test_empty_key_rejected(monkeypatch):
+
+def test_empty_key_rejected(app, monkeypatch):
     monkeypatch.setenv("APP_PASS", "foo")
-    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
-    app = importlib.import_module("app")
-    importlib.reload(app)
     assert app.check_key("") is False
 
 
-def test_slugify_and_unique_slug(monkeypatch):
-    monkeypatch.setenv("APP_PASS", "foo")
-    sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
-    app = importlib.import_module("app")
-    importlib.reload(app)
+def test_slugify_and_unique_slug(app):
     assert app.slugify("Crème fraîche!") == "creme_fraiche"
-    app.st.session_state["slug_counts"] = {}
-    first = app.unique_slug("Crème fraîche")
-    second = app.unique_slug("Creme fraiche")
-    assert first == "creme_fraiche"
-    assert second == "creme_fraiche_1"
+    assert app.slugify("Città - Jalapeño") == "citta_jalapeno"  # table fast path + NFKD fallback
+    assert app.unique_slug("Crème fraîche") == "creme_fraiche"
+    assert app.unique_slug("Crème fraîche") == "creme_fraiche"  # reruns reserve nothing
+    taken = {"creme_fraiche", "creme_fraiche_1"}
+    assert app.unique_slug("Creme fraiche", taken) == "creme_fraiche_2"
+    assert app.unique_slug("creme fraiche 1", taken) == "creme_fraiche_1_1"
+
+
+def test_configured_keys_accepted(app, monkeypatch):
+    monkeypatch.setenv("APP_PASS", "foo, Bar")
+    assert app.check_key(" bar ") is True
+    assert app.check_key("FOO") is True
+    assert app.check_key("baz") is False
+
+
+def test_ceil_step(app):
+    assert app._ceil_step(9.01, 0.5) == 9.5
+    assert app._ceil_step(9.5, 0.5) == 9.5
+    assert app._ceil_step(0.0, 1.0) == 0.0
+    assert app._ceil_step(0.1 + 0.2, 0.1) == 0.3  # float ceil gave 0.4
+    assert app._ceil_step(9.004, 0.5) == 9.5  # fractional cents still round up
+    assert app._ceil_step(9.001, 0.1) == 9.1
+
+
+def test_rev_memo_invalidated_by_data_rev(app):
+    calls = []
+    compute = lambda: calls.append(1) or len(calls)
+    assert app._rev_memo("k", compute) == 1
+    assert app._rev_memo("k", compute) == 1
+    app.st.session_state["data_rev"] = app.st.session_state.get("data_rev", 0) + 1
+    assert app._rev_memo("k", compute) == 2
+
+
+def test_pie_png_bytes(app):
+    png = app._pie_png(("Flour", "Oil"), (2.0, 1.0))
+    assert png.startswith(b"\x89PNG")
+
+
+def test_filter_keys(app):
+    ss = app.st.session_state
+    ss["batches"] = {"b1": {"name": "Pizza Dough"}, "b2": {"name": "Tomato Sauce"}}
+    ss["batches_order"] = ["b1", "b2"]
+    ss["ingredients_order"] = ["Flour", "Fior di latte"]
+    ss["data_rev"] = ss.get("data_rev", 0) + 1
+    assert app.filter_keys("batches", "DOUGH") == ["b1"]
+    assert app.filter_keys("batches", "") == ["b1", "b2"]
+    assert app.filter_keys("ingredients", "fl") == ["Flour"]
+
+
+def test_en_us_money_fast_path_matches_babel(app):
+    babel_numbers = pytest.importorskip("babel.numbers")
+    app.st.session_state["locale"] = "en_US"
+    fmt = app.make_money_formatter("EUR")
+    for x in (0.0, 9.9, -0.001, 2.675, 69062.935, 1234567.891):
+        assert fmt(x) == babel_numbers.format_currency(x, "EUR", locale="en_US")
+    for x in (float("inf"), float("-inf"), float("nan")):  # non-finite values go to Babel
+        assert fmt(x) == babel_numbers.format_currency(x, "EUR", locale="en_US")
+    assert fmt(None) == "—"
+
+
+def test_coalesce_queued_saves(app):
+    saves = [
+        ("batches", {"b1": b"1", "b2": b"2"}, set()),
+        ("batches", {"b1": b"1bis"}, {"b2"}),
+        ("recipes", {"r": b"r"}, set()),
+        ("batches", {"b2": b"2bis"}, set()),
+    ]
+    assert app._coalesce(saves) == {
+        "batches": ({"b1": b"1bis", "b2": b"2bis"}, {"b2"}),
+        "recipes": ({"r": b"r"}, set()),
+    }
+
+
+def test_state_writer_survives_failed_write(app, monkeypatch):
+    def fail(changes):
+        raise OSError("disk full")
+
+    written = []
+    q = app._state_writer()
+    status = app._writer_status()
+    monkeypatch.setattr(app, "_write_rows", fail)
+    q.put(("batches", {"b1": b"1"}, set()))
+    joiner = threading.Thread(target=q.join, daemon=True)
+    joiner.start()
+    joiner.join(2)
+    assert not joiner.is_alive()
+    assert isinstance(status["error"], OSError)
+    q.put(("batches", {"b1": b"1"}, set()))  # failing again: pending stays coalesced
+    q.join()
+    assert status["pending"] == {"batches": ({"b1": b"1"}, set())}
+    # the failed rows are written ahead of the next save
+    monkeypatch.setattr(app, "_write_rows", written.append)
+    q.put(("batches", {"b2": b"2"}, set()))
+    q.join()
+    assert written == [{"batches": ({"b1": b"1", "b2": b"2"}, set())}]
+    assert status["error"] is None and status["pending"] == {}
+
+
+@pytest.fixture
+def state_db(app, tmp_path, monkeypatch):
+    """Point persistence at an empty ``tmp_path`` database; yields a row reader."""
+    writer = app._state_writer  # tests may patch the attribute
+
+    def reset():
+        writer().join()
+        app._db.clear()
+        app._read_ns.clear()
+        app._ns_revs.clear()
+
+    reset()
+    monkeypatch.setattr(app, "DATA_DIR", tmp_path)
+
+    def rows(ns):
+        writer().join()
+        conn, lock = app._db()
+        with lock:
+            return conn.execute("SELECT k, v FROM kv WHERE ns = ? ORDER BY rowid", (ns,)).fetchall()
+
+    yield rows
+    reset()
+
+
+def test_state_migrates_legacy_json_once(app, state_db, tmp_path):
+    (tmp_path / "batches.json").write_text('{"b1": {"name": "Dough"}}')
+    assert app.load_state("batches", {}) == {"b1": {"name": "Dough"}}
+    assert state_db("batches") == [("b1", app._dumps({"name": "Dough"}))]
+    (tmp_path / "batches.json").write_text('{"b9": {}}')  # already migrated: ignored
+    assert app.load_state("batches", {}) == {"b1": {"name": "Dough"}}
+
+
+def test_state_save_round_trip(app, state_db):
+    data = app.load_state("batches", {"b1": {"name": "a"}, "b2": {"name": "b"}, "b3": {"name": "c"}})
+    del data["b2"]
+    data["b1"] = {"name": "a2"}
+    app.save_state("batches", data)
+    assert [k for k, _ in state_db("batches")] == ["b1", "b3"]
+    data["b2"] = {"name": "b2"}  # re-added after the delete: stored last, as in the dict
+    app.save_state("batches", data)
+    assert [k for k, _ in state_db("batches")] == ["b1", "b3", "b2"]
+    loaded = app.load_state("batches", {})
+    assert loaded == data and list(loaded) == ["b1", "b3", "b2"]
+
+
+def test_unchanged_save_queues_nothing(app, state_db, monkeypatch):
+    data = app.load_state("batches", {"b1": {"name": "a"}})
+    queued = []
+    monkeypatch.setattr(app, "_state_writer", lambda: type("Q", (), {"put": queued.append})())
+    app.save_state("batches", dict(data))
+    assert queued == []
+    data["b1"] = {"name": "b"}
+    app.save_state("batches", data)
+    assert queued == [("batches", {"b1": app._dumps({"name": "b"})}, set())]
+
+
+def test_failed_write_rolls_back(app, state_db):
+    app.load_state("batches", {"b1": {"name": "a"}})
+    with pytest.raises(sqlite3.Error):
+        app._write_rows({"batches": ({"b2": b"{}", "b3": object()}, set())})
+    app._write_rows({"batches": ({"b4": b"{}"}, set())})  # no transaction left open
+    assert [k for k, _ in state_db("batches")] == ["b1", "b4"]
+
+
+def test_rev_bumped_only_after_commit(app, state_db):
+    rev = lambda: app._ns_revs()[0].get("batches", 0)
+    app.load_state("batches", {"b1": {"name": "a"}})
+    assert rev() == 1  # migration committed
+    with pytest.raises(sqlite3.Error):
+        app._write_rows({"batches": ({"b2": object()}, set())})
+    assert rev() == 1
+    app._write_rows({"batches": ({"b2": b"{}"}, set())})
+    assert rev() == 2
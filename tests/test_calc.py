@@ -4,12 +4,25 @@ from pathlib import Path
 import pytest
 
 sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
-from calc import unit_cost, batch_total_cost, batch_total_weight_kg
+from calc import (
+    Item, as_item, unit_cost, batch_summary, batch_total_cost, batch_total_weight_kg,
+    to_base, to_weight_kg, unit_costs, ingredient_soa, update_ingredient_soa, density_soa, items_cost, recipe_costs,
+)
 
 
 def test_unit_cost():
     ingredients = {"Flour": {"package_price": 25.0, "package_qty": 25}}
     assert unit_cost("Flour", ingredients) == pytest.approx(1.0)
+    assert unit_costs(ingredients) == {"Flour": unit_cost("Flour", ingredients)}
+
+
+def test_unit_conversions():
+    assert to_base(500, "g") == pytest.approx(0.5)
+    assert to_base(250, "ml") == pytest.approx(0.25)
+    assert to_base(2, "L") == 2
+    assert to_weight_kg("Oil", 500, "ml", {"Oil": 0.9}) == pytest.approx(0.45)
+    assert to_weight_kg("Oil", 1, "L", {}) == 0.0
+    assert to_weight_kg("Eggs", 3, "pcs", {}) == 0.0
 
 
 def test_batch_total_cost():
@@ -40,8 +53,157 @@ def test_batch_total_weight_kg():
     assert unknown == 1
 
 
+def test_items_as_namedtuples_or_rows():
+    ingredients = {"Flour": {"package_price": 2.0, "package_qty": 1}}
+    assert as_item({"name": "Flour", "qty": 1, "unit": "kg"}) == Item("Flour", 1.0, "kg")
+    assert as_item(["Flour", "250", "g"]) == Item("Flour", 250.0, "g")
+    batch = {"items": [Item("Flour", 1.0, "kg"), ["Flour", 500, "g"]]}
+    assert batch_total_cost(batch, ingredients) == pytest.approx(3.0)
+
+
+def test_batch_summary_matches_separate_totals():
+    ingredients = {
+        "Flour": {"package_price": 2.0, "package_qty": 1},
+        "Water": {"package_price": 1.0, "package_qty": 1},
+    }
+    densities = {"Water": 1.0}
+    batch = {
+        "items": [
+            {"name": "Flour", "qty": 1, "unit": "kg"},
+            {"name": "Water", "qty": 500, "unit": "ml"},
+            {"name": "Oil", "qty": 100, "unit": "ml"},
+        ]
+    }
+    cost, weight, unknown = batch_summary(batch, ingredients, densities)
+    assert cost == pytest.approx(2.5)  # Oil is not in the catalog: no cost, no error
+    assert (weight, unknown) == pytest.approx(batch_total_weight_kg(batch, densities))
+
+
+def test_ingredient_soa_prices():
+    ingredients = {
+        "Flour": {"package_price": 2.0, "package_qty": 1},
+        "Oil": {"package_price": 9.0, "package_qty": 3},
+    }
+    soa = ingredient_soa(ingredients)
+    items = [Item("Flour", 500.0, "g"), Item("Oil", 1.0, "L"), Item("Salt", 10.0, "g")]
+    assert items_cost(items, soa) == pytest.approx(4.0)  # Salt is missing: priced at zero
+    batch = {"items": items[:2]}
+    assert batch_total_cost(batch, ingredients, soa) == pytest.approx(batch_total_cost(batch, ingredients))
+    assert items_cost([], ingredient_soa({})) == 0.0
+    ingredients["Oil"] = {"package_price": 12.0, "package_qty": 4}
+    update_ingredient_soa(soa, "Oil", ingredients["Oil"])
+    assert soa.unit_cost.tolist() == ingredient_soa(ingredients).unit_cost.tolist()
+
+
+def test_recipe_costs_csr():
+    soa = ingredient_soa({"Basil": {"package_price": 10.0, "package_qty": 1}})
+    recipes = {
+        "Margherita": {
+            "portions": 2,
+            "items": [Item("Basil", 20.0, "g"), Item("Truffle", 5.0, "g")],
+            "batch_uses": [{"batch_id": "b1", "portions": 1.0}, {"batch_id": "gone", "portions": 1.0}],
+        },
+        "Marinara": {"items": [], "batch_uses": [{"batch_id": "b2", "portions": 2.0}]},
+        "Empty": {},
+    }
+    costs = recipe_costs(recipes, {"b1": 1.5, "b2": None}, soa)
+    assert costs == pytest.approx({"Margherita": 1.6, "Marinara": 0.0, "Empty": 0.0})
+
+
+def test_density_soa_matches_dict():
+    densities = {"Water": 1.0, "Oil": 0.91, "Milk": None}
+    batch = {"items": [Item("Water", 500.0, "ml"), Item("Oil", 1.0, "L"), Item("Milk", 1.0, "L"),
+                       Item("Vinegar", 1.0, "L"), Item("Flour", 1.0, "kg")]}
+    expected = batch_total_weight_kg(batch, densities)
+    assert batch_total_weight_kg(batch, densities, density_soa(densities)) == pytest.approx(expected)
+    assert expected[1] == 2  # Milk (None) and Vinegar (absent)
+
+
 def test_batch_total_cost_unknown():
     ingredients = {"Flour": {"package_price": 2.0, "package_qty": 1}}
     batch = {"items": [{"name": "Flour", "qty": 1, "unit": "kg"}, {"name": "Salt", "qty": 1, "unit": "kg"}]}
     with pytest.raises(ValueError):
         batch_total_cost(batch, ingredients)
+
+
+def test_batch_total_weight_kg_mixed_units():
+    densities = {"Oil": 0.9, "Milk": 1.0}
+    batch = {
+        "items": [
+            {"name": "Flour", "qty": 250, "unit": "g"},
+            {"name": "Oil", "qty": 2, "unit": "L"},
+            {"name": "Milk", "qty": 0, "unit": "ml"},
+            {"name": "Eggs", "qty": 3, "unit": "pcs"},
+        ]
+    }
+    total, unknown = batch_total_weight_kg(batch, densities)
+    assert total == pytest.approx(2.05)
+    assert unknown == 1
+    assert batch_total_weight_kg({"items": []}, densities) == (0.0, 0)
+
+
+def test_numba_sum_cost_kernel():
+    pytest.importorskip("numba")
+    import numpy as np
+    from calc_numba import sum_cost
+
+    qty = np.array([1.0, 500.0, 2.0])
+    scale = np.array([1.0, 1e-3, 1.0])
+    price = np.array([2.0, 1.0, 3.0])
+    valid = np.array([True, True, False])
+    assert sum_cost(qty, scale, price, valid) == pytest.approx(2.5)
+
+
+def test_numba_batch_totals_kernel():
+    pytest.importorskip("numba")
+    import numpy as np
+    from calc_numba import batch_totals
+
+    qty = np.array([1.0, 500.0, 100.0])
+    unit_code = np.array([0, 3, 3], dtype=np.int8)
+    price = np.array([2.0, 1.0, 0.0])
+    valid = np.array([True, True, False])
+    density = np.array([0.0, 1.0, 0.0])
+    cost, weight, unknown = batch_totals(qty, unit_code, price, valid, density)
+    assert cost == pytest.approx(2.5)
+    assert weight == pytest.approx(1.5)
+    assert unknown == 1
+
+
+def test_numba_parallel_batch_totals_matches_serial():
+    pytest.importorskip("numba")
+    import numpy as np
+    from calc_numba import batch_totals, batch_totals_parallel
+
+    rng = np.random.default_rng(0)
+    n = 10_000
+    qty = rng.random(n)
+    unit_code = rng.integers(-1, 4, n).astype(np.int8)
+    price = rng.random(n)
+    valid = rng.random(n) > 0.1
+    density = np.where(rng.random(n) > 0.2, rng.random(n), 0.0)
+    cost, weight, unknown = batch_totals_parallel(qty, unit_code, price, valid, density)
+    ref_cost, ref_weight, ref_unknown = batch_totals(qty, unit_code, price, valid, density)
+    assert cost == pytest.approx(ref_cost)
+    assert weight == pytest.approx(ref_weight)
+    assert unknown == ref_unknown
+
+
+def test_numba_weight_sum_kernel():
+    pytest.importorskip("numba")
+    import numpy as np
+    from calc_numba import weight_sum
+
+    qty = np.array([1.0, 250.0, 2.0, 100.0, 5.0])
+    unit_code = np.array([0, 1, 2, 3, -1], dtype=np.int8)
+    density = np.array([0.0, 0.0, 0.9, 0.0, 1.0])
+    weight, unknown = weight_sum(qty, unit_code, density)
+    assert weight == pytest.approx(1.0 + 0.25 + 1.8)
+    assert unknown == 1
+
+
+def test_unknown_unit_scale():
+    ingredients = {"Salt": {"package_price": 1.0, "package_qty": 1}}
+    batch = {"items": [Item("Salt", 2.0, "oz"), Item("Salt", 500.0, "g")]}
+    assert batch_total_cost(batch, ingredients) == pytest.approx(2.5)  # unknown unit taken as base
+    assert batch_total_weight_kg(batch, {}) == pytest.approx((0.5, 0))  # ...but weighs nothing